@@ -1,19 +1,25 @@
 from .batch import Batch
 from .filter import Filter
 from .filter_cached import FilterCached
+from .join import Join, JoinIndex
 from .limit import Limit
 from .log import Log
-from .map import Map
+from .map import Map, is_cancelled
 from .map_key import MapKey
 from .mix import Mix
+from .read_bytes import ReadBytes
 from .read_csv import ReadCSV
 from .read_files import ReadFiles
 from .read_lines import ReadLines
+from .read_records import ReadRecords, Records
 from .repeat import Repeat
 from .shuffle import Shuffle
 from .side import Side
 from .sleep import Sleep
+from .sort import Sort
+from .tee import Tee
 from .tqdm import Tqdm
 from .unbatch import Unbatch
 from .write_csv import WriteCSV
 from .write_lines import WriteLines
+from .write_records import WriteRecords
@@ -1,19 +1,59 @@
-from typing import Callable, Iterable, Iterator, TypeVar
+from typing import Any, Callable, Iterable, Iterator, TypeVar
 
 from pipd import Pipe
 
-from .map import Map
+from .map import Map, collate_batch, import_numpy
 
 T = TypeVar("T")
 
 
+def apply_mask(batch: Any, mask: Any) -> Any:
+    if isinstance(batch, dict):
+        return {key: column[mask] for key, column in batch.items()}
+    if isinstance(batch, (list, tuple)):
+        return [item for item, keep in zip(batch, mask) if keep]
+    return batch[mask]
+
+
+def batch_size(batch: Any) -> int:
+    if isinstance(batch, dict):
+        return min((len(column) for column in batch.values()), default=0)
+    return len(batch)
+
+
+def filter_batch(fn: Callable, use_collate: bool, batch: Any, *state: Any) -> Any:
+    np = import_numpy()
+    data = batch
+    if use_collate and isinstance(batch, (list, tuple)) and len(batch) > 0:
+        data = collate_batch(batch)
+    return apply_mask(batch, np.asarray(fn(data, *state), dtype=bool))
+
+
 class Filter(Pipe):
-    def __init__(self, fn: Callable[[T], bool], *args, **kwargs) -> None:
-        self.fn = lambda x: (x, fn(x))
+    def __init__(
+        self,
+        fn: Callable[[T], bool],
+        *args,
+        batched: bool = False,
+        collate: bool = True,
+        **kwargs,
+    ) -> None:
+        if batched:
+            self.fn = lambda x, *state: filter_batch(fn, collate, x, *state)
+        else:
+            self.fn = lambda x, *state: (x, fn(x, *state))
+        self.batched = batched
         self.args = args
         self.kwargs = kwargs
 
     def __call__(self, items: Iterable[T]) -> Iterator[T]:  # type: ignore
+        if self.batched:
+            # Masks are applied per batch, empty batches are dropped
+            batch: Any
+            for batch in Map(self.fn, *self.args, **self.kwargs)(items):
+                if batch_size(batch) > 0:
+                    yield batch
+            return
         for item, keep in Map(self.fn, *self.args, **self.kwargs)(items):  # type: ignore
             if keep:  # type: ignore
                 yield item  # type: ignore
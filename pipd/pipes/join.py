@@ -0,0 +1,262 @@
+import csv
+import hashlib
+import json
+import marshal
+import mmap
+import os
+from array import array
+from bisect import bisect_left
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from pipd import Pipe
+
+from .read_records import map_file
+from .sort import Sort
+from .write_records import LENGTH
+
+INDEX_MAGIC = b"PIPDJIDX"
+
+
+def key_hash(key: Any) -> int:
+    # Stable across processes, unlike hash()
+    digest = hashlib.blake2b(str(key).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def key_id(key: Union[str, Callable, None]) -> Optional[str]:
+    """Identifies a key in the index header. Callables are identified by their
+    bytecode and closure, so two lambdas with the same name don't collide."""
+    if not callable(key):
+        return key
+    code = getattr(key, "__code__", None)
+    if code is None:  # e.g. operator.itemgetter, whose repr holds its arguments
+        return repr(key)
+    closure = [cell.cell_contents for cell in key.__closure__ or ()]  # type: ignore
+    data = marshal.dumps(code) + repr(closure).encode()
+    digest = hashlib.blake2b(data, digest_size=8).hexdigest()
+    return f"{key.__module__}.{key.__qualname__}:{digest}"
+
+
+def sort_index(hashes: array, offsets: array) -> Tuple[array, array]:
+    """Sorts (hash, offset) pairs by hash, vectorized with numpy if available,
+    else with an external sort, never as a list of Python ints."""
+    try:
+        import numpy as np
+    except ImportError:
+        pairs = Sort(max_memory=2**28)(zip(hashes, offsets))
+        sorted_hashes, sorted_offsets = array("Q"), array("Q")
+        for value, offset in pairs:
+            sorted_hashes.append(value)
+            sorted_offsets.append(offset)
+        return sorted_hashes, sorted_offsets
+    np_hashes = np.frombuffer(hashes, dtype=np.uint64)
+    order = np.argsort(np_hashes, kind="stable")
+    sorted_hashes = array("Q", np_hashes[order].tobytes())
+    sorted_offsets = array(
+        "Q", np.frombuffer(offsets, dtype=np.uint64)[order].tobytes()
+    )
+    return sorted_hashes, sorted_offsets
+
+
+class JoinIndex:
+    """Index of (key hash, line offset) pairs over a memory-mapped CSV or lines
+    file. With `index_filepath` the index is stored on disk and memory-mapped,
+    so it is built once and shared read-only across processes."""
+
+    def __init__(
+        self,
+        filepath: str,
+        key: Union[str, Callable, None] = None,
+        format: str = "csv",
+        header: Union[bool, Sequence[str]] = True,
+        index_filepath: Optional[str] = None,
+    ) -> None:
+        assert format in ["csv", "lines"]
+        assert format == "lines" or key is not None, "key is required for csv"
+        self.filepath = filepath
+        self.key = key
+        self.format = format
+        self.header = header
+        self.index_filepath = index_filepath
+        self.open()
+
+    def open(self, arrays: Optional[tuple] = None) -> None:
+        self.data = map_file(self.filepath)
+        start = 0
+        self.fieldnames: Optional[Sequence[str]] = None
+        if self.format == "csv" and isinstance(self.header, Sequence):
+            self.fieldnames = self.header
+        elif self.format == "csv" and self.header:
+            line, start = self.read_line(0)
+            self.fieldnames = next(csv.reader([line]))
+
+        self.index: Any = None
+        self.views: List[memoryview] = []
+        self.hashes: Sequence[int]
+        self.offsets: Sequence[int]
+        if arrays is not None:
+            self.hashes, self.offsets = arrays
+        elif self.index_filepath is None:
+            self.hashes, self.offsets = self.build(start)
+        elif not self.load():
+            hashes, offsets = self.build(start)
+            with open(self.index_filepath, "wb") as file:
+                file.write(self.index_header())
+                hashes.tofile(file)
+                offsets.tofile(file)
+            del hashes, offsets
+            assert self.load()
+
+    def index_header(self) -> bytes:
+        # Identifies the lookup file and key the index was built for
+        stat = os.stat(self.filepath)
+        header = dict(
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            key=key_id(self.key),
+            format=self.format,
+            header=self.header,
+        )
+        data = json.dumps(header).encode()
+        data += b" " * (-len(data) % 8)  # Keep the arrays 8-byte aligned
+        return INDEX_MAGIC + LENGTH.pack(len(data)) + data
+
+    def load(self) -> bool:
+        """Memory-maps the index file, False if it is missing or stale."""
+        if not os.path.exists(self.index_filepath):  # type: ignore
+            return False
+        index = map_file(self.index_filepath)  # type: ignore
+        header = self.index_header()
+        if index[: len(header)] != header:
+            if isinstance(index, mmap.mmap):
+                index.close()
+            return False
+        self.index = index
+        view = memoryview(index)[len(header) :].cast("Q")
+        self.hashes = view[: len(view) // 2]
+        self.offsets = view[len(view) // 2 :]
+        self.views = [self.hashes, self.offsets, view]  # type: ignore
+        return True
+
+    def build(self, start: int) -> Tuple[array, array]:
+        hashes, offsets = array("Q"), array("Q")
+        while start < len(self.data):
+            line, end = self.read_line(start)
+            if line:
+                hashes.append(key_hash(self.key_of(self.parse(line))))
+                offsets.append(start)
+            start = end
+        return sort_index(hashes, offsets)
+
+    def close(self) -> None:
+        for view in self.views:
+            view.release()
+        for file in [self.data, self.index]:
+            if isinstance(file, mmap.mmap):
+                file.close()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        for name in ["data", "index", "views", "fieldnames", "hashes", "offsets"]:
+            del state[name]
+        if self.index_filepath is None:  # No index on disk, ship the in-memory one
+            state["arrays"] = (self.hashes, self.offsets)
+        return state
+
+    def __setstate__(self, state) -> None:
+        arrays = state.pop("arrays", None)
+        self.__dict__.update(state)
+        self.open(arrays)
+
+    def read_line(self, start: int):
+        end = self.data.find(b"\n", start)
+        end = len(self.data) if end == -1 else end
+        return self.data[start:end].decode().rstrip("\r"), end + 1
+
+    def parse(self, line: str) -> Any:
+        if self.format == "lines":
+            return line
+        values = next(csv.reader([line]))
+        return dict(zip(self.fieldnames, values)) if self.fieldnames else values
+
+    def key_of(self, row: Any) -> Any:
+        if self.key is None:
+            return row
+        if callable(self.key):
+            return self.key(row)
+        return row[self.key]
+
+    def get(self, key: Any) -> List[Any]:
+        rows = []
+        value = key_hash(key)
+        i = bisect_left(self.hashes, value)
+        while i < len(self.hashes) and self.hashes[i] == value:
+            row = self.parse(self.read_line(self.offsets[i])[0])
+            if str(self.key_of(row)) == str(key):  # Skip hash collisions
+                rows.append(row)
+            i += 1
+        return rows
+
+
+class Join(Pipe):
+    def __init__(
+        self,
+        filepath: str,
+        key: Union[str, Callable, None] = None,
+        on: Union[str, Callable, None] = None,
+        how: str = "inner",
+        format: str = "csv",
+        header: Union[bool, Sequence[str]] = True,
+        index_filepath: Optional[str] = None,
+        batched: bool = False,
+    ) -> None:
+        assert how in ["inner", "left"]
+        self.filepath = filepath
+        self.key = key
+        self.on = on if on is not None else key
+        self.how = how
+        self.format = format
+        self.header = header
+        self.index_filepath = index_filepath
+        self.batched = batched
+
+    def join(self, index: JoinIndex, item: Any) -> Iterator[Any]:
+        if self.on is None:
+            key = item
+        else:
+            key = self.on(item) if callable(self.on) else item[self.on]
+        rows = index.get(key)
+        if not rows and self.how == "left":
+            rows = [None]
+        for row in rows:
+            if isinstance(item, dict) and (row is None or isinstance(row, dict)):
+                yield {**item, **(row or {})}
+            else:
+                yield (item, row)
+
+    def __call__(self, items: Iterable[Any]) -> Iterator[Any]:  # type: ignore
+        index = JoinIndex(
+            self.filepath,
+            key=self.key,
+            format=self.format,
+            header=self.header,
+            index_filepath=self.index_filepath,
+        )
+        try:
+            for item in items:
+                if self.batched:
+                    yield [row for x in item for row in self.join(index, x)]
+                else:
+                    yield from self.join(index, item)
+        finally:
+            index.close()
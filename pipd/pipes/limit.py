@@ -10,7 +10,12 @@ class Limit(Pipe):
         self.limit = limit
 
     def __call__(self, items: Iterable[T]) -> Iterator[T]:  # type: ignore
-        for count, item in enumerate(items):
-            if count >= self.limit:
-                return
-            yield item
+        it = iter(items)
+        try:
+            # range first, so no item is pulled past the limit
+            for _, item in zip(range(self.limit), it):
+                yield item
+        finally:
+            # Stop upstream now (e.g. cancel parallel work) instead of on collection
+            if hasattr(it, "close"):
+                it.close()  # type: ignore
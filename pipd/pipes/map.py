@@ -1,10 +1,35 @@
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from collections import deque
 from concurrent.futures import (
     FIRST_COMPLETED,
+    Executor,
+    Future,
     ProcessPoolExecutor,
     ThreadPoolExecutor,
     wait,
 )
-from typing import Callable, Iterable, Iterator, Optional, TypeVar
+from functools import partial
+from statistics import median
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 from pipd import Pipe, log_traceback_and_continue
 
@@ -12,50 +37,511 @@ T = TypeVar("T")
 U = TypeVar("U")
 
 
+# Function and state of the current worker thread (or process)
+worker = threading.local()
+
+
+def init_worker(
+    fn: Callable,
+    init_fn: Optional[Callable] = None,
+    cancelled: Any = None,
+    slots: Any = None,
+) -> None:
+    worker.fn = fn
+    worker.cancelled = cancelled
+    worker.slots = slots
+    worker.init = init_fn is not None
+    worker.state = init_fn() if init_fn is not None else None
+
+
+def call_worker(item: Any) -> Any:
+    return worker.fn(item, worker.state) if worker.init else worker.fn(item)
+
+
+def call_worker_in_slot(slot: int, item: Any) -> Any:
+    # Tell the parent which process runs this call, so it can kill it if it hangs
+    worker.slots[slot] = os.getpid()
+    return call_worker(item)
+
+
+def is_cancelled() -> bool:
+    """True in a worker once its pipe was closed early (e.g. by `Limit`), so
+    that long running functions can stop cooperatively."""
+    cancelled = getattr(worker, "cancelled", None)
+    return cancelled is not None and cancelled.is_set()
+
+
+def create_executor(
+    mode: str,
+    max_workers: int,
+    fn: Callable,
+    init_fn: Optional[Callable] = None,
+    slots: Any = None,
+) -> Tuple[Executor, Any]:
+    # Send fn to each worker once, tasks then only carry the item
+    if mode == "multiprocess":
+        cancelled: Any = multiprocessing.Event()
+        executor: Executor = ProcessPoolExecutor(
+            max_workers,
+            initializer=init_worker,
+            initargs=(fn, init_fn, cancelled, slots),
+        )
+    else:
+        cancelled = threading.Event()
+        executor = ThreadPoolExecutor(
+            max_workers, initializer=init_worker, initargs=(fn, init_fn, cancelled)
+        )
+    return executor, cancelled
+
+
+def import_numpy() -> Any:
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("numpy is required to use batched")
+    return numpy
+
+
+def collate_batch(batch: Sequence[Any]) -> Any:
+    """Stacks a batch of arrays/numbers into an array, or a batch of dicts into a
+    dict of column arrays."""
+    np = import_numpy()
+    if isinstance(batch[0], dict):
+        return {key: np.asarray([item[key] for item in batch]) for key in batch[0]}
+    return np.asarray(batch)
+
+
+def uncollate_batch(output: Any) -> List[Any]:
+    if isinstance(output, dict):
+        return [dict(zip(output, values)) for values in zip(*output.values())]
+    return list(output)
+
+
+def call_collated(fn: Callable, uncollate: bool, batch: Any, *state: Any) -> Any:
+    # Batches that are already columns (e.g. from another batched Map) pass through
+    if isinstance(batch, (list, tuple)) and len(batch) > 0:
+        batch = collate_batch(batch)
+    output = fn(batch, *state)
+    return uncollate_batch(output) if uncollate else output
+
+
+class AdaptiveLimit:
+    """Additive-increase/multiplicative-decrease limit on the number of tasks in
+    flight: grows by one per window while latency and throughput hold, halves
+    when the median latency rises `tolerance` times above the baseline latency
+    or when calls fail or time out."""
+
+    def __init__(
+        self,
+        min_limit: int = 1,
+        max_limit: int = 32,
+        window: int = 8,
+        tolerance: float = 2.0,
+    ) -> None:
+        assert 1 <= min_limit <= max_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.window = window
+        self.tolerance = tolerance
+        self.limit = min_limit
+        self.latencies: List[float] = []
+        self.baseline = float("inf")
+        self.throughput = 0.0
+        self.window_start = time.monotonic()
+        self.since_decrease = 0
+
+    def decrease(self) -> None:
+        # At most once per round of in-flight tasks, so a burst of failures from
+        # the same overload halves the limit only once
+        self.since_decrease += 1
+        if self.since_decrease < self.limit:
+            return
+        self.limit = max(self.min_limit, self.limit // 2)
+        self.since_decrease = 0
+        self.latencies = []
+        self.window_start = time.monotonic()
+
+    def update(self, latency: float) -> None:
+        self.since_decrease += 1
+        self.latencies.append(latency)
+        if len(self.latencies) < max(self.window, self.limit):
+            return
+        now = time.monotonic()
+        throughput = len(self.latencies) / max(now - self.window_start, 1e-9)
+        latency = median(self.latencies)
+        # Let the baseline drift up slowly so it follows backend changes
+        self.baseline = min(self.baseline * 1.1, latency)
+        if latency > self.tolerance * self.baseline:
+            self.limit = max(self.min_limit, self.limit // 2)
+        elif throughput >= 0.9 * self.throughput:
+            self.limit = min(self.max_limit, self.limit + 1)
+        self.throughput = throughput
+        self.latencies = []
+        self.window_start = now
+
+
+class Task:
+    """An item being mapped, with all its attempts (retries and hedges)."""
+
+    def __init__(self, item: Any) -> None:
+        self.item = item
+        self.attempt = 0
+        self.futures: Dict[Future, float] = {}
+        self.retry_at: Optional[float] = None
+        self.hedged = False
+
+
+class Scheduler:
+    """Runs the tasks of one `Map.__call__` on an executor, applying timeouts,
+    retries with exponential backoff and hedging. Calls are only submitted when
+    a worker is free, so their timeout and latency don't include queueing."""
+
+    def __init__(
+        self,
+        mode: str,
+        num_workers: int,
+        fn: Callable,
+        handler: Callable,
+        init_fn: Optional[Callable] = None,
+        limit: Optional[AdaptiveLimit] = None,
+        timeout: Optional[float] = None,
+        retries: int = 0,
+        backoff: float = 0.0,
+        hedge: Optional[float] = None,
+    ) -> None:
+        self.mode = mode
+        self.num_workers = num_workers
+        self.fn = fn
+        self.init_fn = init_fn
+        self.handler = handler
+        self.limit = limit
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge = hedge
+        self.tasks: Set[Task] = set()
+        self.queued: Deque[Task] = deque()
+        self.running: Dict[Future, Task] = {}
+        self.retrying: List[Task] = []
+        self.latencies: Deque[float] = deque(maxlen=100)
+        self.abandoned = False
+        self.hung: List[Future] = []
+        self.start()
+
+    def start(self) -> None:
+        # Calls abandoned in processes still hold their process until it is killed
+        self.occupied: Set[Future] = set()
+        self.slot_of: Dict[Future, int] = {}
+        if self.mode == "multiprocess":
+            self.slots = multiprocessing.Array("q", self.num_workers, lock=False)
+            self.free_slots = list(range(self.num_workers))
+            self.executor, self.cancelled = create_executor(
+                self.mode, self.num_workers, self.fn, self.init_fn, self.slots
+            )
+        else:
+            # Threads are spawned on demand, so a new thread takes over from each
+            # abandoned call that is still running
+            self.executor, self.cancelled = create_executor(
+                self.mode, sys.maxsize, self.fn, self.init_fn
+            )
+
+    def restart(self) -> None:
+        # Killing a process breaks the pool, so this waits until the healthy calls
+        # have finished (none are re-run), then kills the hung ones and starts a new
+        # pool. Its workers run init_fn again
+        for future in self.hung:
+            self.kill(future)
+        self.hung.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.start()
+
+    def shutdown(self, completed: bool) -> None:
+        # Closed early: drop queued tasks and signal running ones. Abandoned calls
+        # can't be interrupted, so don't wait for them either
+        if not completed:
+            self.cancelled.set()
+        for future in self.hung:
+            self.kill(future)
+        self.executor.shutdown(
+            wait=completed and not self.abandoned and not self.occupied,
+            cancel_futures=True,
+        )
+
+    def __len__(self) -> int:
+        return len(self.tasks)
+
+    def capacity(self) -> int:
+        return self.limit.limit if self.limit is not None else self.num_workers
+
+    def busy(self) -> int:
+        if self.occupied:
+            self.occupied = {f for f in self.occupied if not self.done(f)}
+        return len(self.running) + len(self.occupied)
+
+    def add(self, item: Any) -> None:
+        task = Task(item)
+        self.tasks.add(task)
+        self.queued.append(task)
+        self.dispatch()
+
+    def dispatch(self) -> None:
+        while self.queued and not self.hung and self.busy() < self.capacity():
+            self.submit(self.queued.popleft())
+
+    def submit(self, task: Task) -> None:
+        if self.mode == "multiprocess":
+            slot = self.free_slots.pop()
+            self.slots[slot] = 0
+            future = self.executor.submit(call_worker_in_slot, slot, task.item)
+            self.slot_of[future] = slot
+        else:
+            future = self.executor.submit(call_worker, task.item)
+        task.futures[future] = time.monotonic()
+        self.running[future] = task
+
+    def done(self, future: Future) -> bool:
+        if future.done() and future in self.slot_of:
+            self.free_slots.append(self.slot_of.pop(future))
+        return future.done()
+
+    def abandon(self, future: Future) -> bool:
+        """Drops a running attempt, returns True if its process must be killed."""
+        del self.running[future]
+        if future.cancel():
+            self.done(future)
+            return False
+        if self.mode == "multithread":
+            self.abandoned = True
+            return False
+        self.occupied.add(future)
+        return True
+
+    def kill(self, future: Future) -> None:
+        pid = self.slots[self.slot_of[future]]
+        if pid:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def hedge_after(self) -> Optional[float]:
+        if self.hedge is None or len(self.latencies) < 10:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[int(self.hedge * (len(latencies) - 1))]
+
+    def fail(self, task: Task, exception: BaseException) -> None:
+        if self.limit is not None:  # Errors and timeouts signal overload
+            self.limit.decrease()
+        if task.futures:  # A hedged attempt is still running
+            return
+        if task.attempt < self.retries:
+            task.retry_at = time.monotonic() + self.backoff * 2**task.attempt
+            task.attempt += 1
+            task.hedged = False
+            self.retrying.append(task)
+        else:
+            self.tasks.remove(task)
+            self.handler(exception)
+
+    def collect(self) -> Iterator[Any]:
+        self.dispatch()
+        hedge_after = self.hedge_after()
+        deadlines = [task.retry_at for task in self.retrying]
+        if self.timeout is not None or hedge_after is not None:
+            for future, task in self.running.items():
+                if self.timeout is not None:
+                    deadlines.append(task.futures[future] + self.timeout)
+                if hedge_after is not None and not task.hedged:
+                    deadlines.append(task.futures[future] + hedge_after)
+        now = time.monotonic()
+        timeout = max(0.0, min(deadlines) - now) if deadlines else None  # type: ignore
+        futures = set(self.running) | self.occupied
+        if futures:
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+        else:
+            time.sleep(timeout or 0.0)
+            done = set()
+
+        now = time.monotonic()
+        for future in done:
+            self.done(future)
+            task = self.running.pop(future, None)  # type: ignore
+            if task is None:  # An abandoned attempt finished
+                continue
+            start = task.futures.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                self.fail(task, e)
+                continue
+            latency = now - start
+            self.latencies.append(latency)
+            if self.limit is not None:
+                self.limit.update(latency)
+            # Keep the first result, drop the other attempts of this item
+            self.tasks.remove(task)
+            for other in task.futures:
+                self.abandon(other)
+            task.futures.clear()
+            yield result
+
+        for future, task in list(self.running.items()):
+            start = task.futures[future]
+            if self.timeout is not None and now - start >= self.timeout:
+                if self.abandon(future):
+                    self.hung.append(future)
+                del task.futures[future]
+                self.fail(task, TimeoutError(f"Map timed out after {self.timeout}s"))
+            elif hedge_after is not None and not task.hedged:
+                if (
+                    now - start >= hedge_after
+                    and not self.hung
+                    and self.busy() < self.capacity()
+                ):
+                    task.hedged = True
+                    self.submit(task)
+        if self.hung and not self.running:
+            self.restart()
+
+        for task in [task for task in self.retrying if task.retry_at <= now]:  # type: ignore # noqa
+            self.retrying.remove(task)
+            self.queued.append(task)
+        self.dispatch()
+
+
 class Map(Pipe):
     def __init__(
         self,
         fn: Callable[[T], U],
-        num_workers: int = 0,
+        num_workers: Union[int, str] = 0,
         buffer: Optional[int] = None,
         mode: str = "multithread",
         handler: Callable = log_traceback_and_continue,
+        min_workers: int = 1,
+        max_workers: int = 32,
+        timeout: Optional[float] = None,
+        retries: int = 0,
+        backoff: float = 0.0,
+        hedge: Optional[float] = None,
+        init_fn: Optional[Callable[[], Any]] = None,
+        batched: bool = False,
+        collate: bool = True,
+        uncollate: bool = False,
     ) -> None:
 
         assert mode in ["multithread", "multiprocess"]
-        self.fn = fn
+        assert isinstance(num_workers, int) or num_workers == "auto"
+        assert (
+            num_workers != "auto" or buffer is None
+        ), "buffer is set by the adaptive limit with num_workers='auto'"
+        assert hedge is None or 0 < hedge < 1, "hedge must be a latency percentile"
+        assert num_workers != 0 or (
+            timeout is None and hedge is None
+        ), "timeout and hedge require num_workers > 0"
+        # Batched: fn is applied to whole batches, collated into numpy columns, and
+        # its output stays columnar for the next batched stage unless uncollate=True
+        self.fn = partial(call_collated, fn, uncollate) if batched and collate else fn
         self.num_workers = num_workers
         self.buffer = buffer
         self.mode = mode
         self.handler = handler
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge = hedge
+        self.init_fn = init_fn
 
     def __call__(self, items: Iterable[T]) -> Iterator[U]:  # type: ignore
         if self.num_workers == 0:
+            state = self.init_fn() if self.init_fn is not None else None
             for item in items:
-                try:
-                    yield self.fn(item)
-                except Exception as e:
-                    self.handler(e)
+                for attempt in range(self.retries + 1):
+                    try:
+                        if self.init_fn is not None:
+                            result = self.fn(item, state)  # type: ignore
+                        else:
+                            result = self.fn(item)
+                    except Exception as e:
+                        if attempt == self.retries:
+                            self.handler(e)
+                        else:
+                            time.sleep(self.backoff * 2**attempt)
+                        continue
+                    yield result
+                    break
             return
 
-        executors = dict(
-            multithread=ThreadPoolExecutor, multiprocess=ProcessPoolExecutor
+        if (
+            self.num_workers != "auto"
+            and self.timeout is None
+            and self.hedge is None
+            and self.retries == 0
+        ):
+            # Fast path: nothing to schedule, keep the executor's queue filled
+            yield from self.map_unscheduled(items)
+            return
+
+        if self.num_workers == "auto":
+            limit = AdaptiveLimit(self.min_workers, self.max_workers)
+            max_workers = self.max_workers
+        else:
+            limit = None
+            max_workers = self.num_workers  # type: ignore
+        buffer = self.buffer or max_workers
+
+        scheduler = Scheduler(
+            self.mode,
+            max_workers,
+            self.fn,
+            self.handler,
+            init_fn=self.init_fn,
+            limit=limit,
+            timeout=self.timeout,
+            retries=self.retries,
+            backoff=self.backoff,
+            hedge=self.hedge,
         )
+        completed = False
+        try:
+            for item in items:
+                scheduler.add(item)
+                while len(scheduler) >= (limit.limit if limit else buffer):
+                    yield from scheduler.collect()
+            while scheduler:
+                yield from scheduler.collect()
+            completed = True
+        finally:
+            scheduler.shutdown(completed)
 
-        with executors[self.mode](max_workers=self.num_workers) as executor:
-            futures = set()
-            self.buffer = self.buffer or self.num_workers
+    def map_unscheduled(self, items: Iterable[T]) -> Iterator[U]:
+        executor, cancelled = create_executor(
+            self.mode, self.num_workers, self.fn, self.init_fn  # type: ignore
+        )
+        buffer: int = self.buffer or self.num_workers  # type: ignore
+        futures: Set[Future] = set()
+        completed = False
+        try:
             for item in items:
-                futures.add(executor.submit(self.fn, item))
-                if len(futures) == self.buffer:
+                futures.add(executor.submit(call_worker, item))
+                if len(futures) >= buffer:
                     done, futures = wait(futures, return_when=FIRST_COMPLETED)
-                    for future in done:
-                        try:
-                            yield future.result()
-                        except Exception as e:
-                            self.handler(e)
-            for future in futures:
-                try:
-                    yield future.result()
-                except Exception as e:
-                    self.handler(e)
+                    yield from self.results(done)
+            while futures:
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                yield from self.results(done)
+            completed = True
+        finally:
+            # Closed early: drop queued tasks and signal running ones
+            if not completed:
+                cancelled.set()
+            executor.shutdown(wait=completed, cancel_futures=True)
+
+    def results(self, futures: Iterable[Future]) -> Iterator[U]:
+        for future in futures:
+            try:
+                yield future.result()
+            except Exception as e:
+                self.handler(e)
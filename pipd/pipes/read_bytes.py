@@ -0,0 +1,106 @@
+import mmap
+import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from pipd import Pipe, log_traceback_and_continue
+
+
+def read_file(filepath: str, mmap_threshold: int) -> Union[bytes, mmap.mmap]:
+    with open(filepath, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if size >= mmap_threshold:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return file.read()
+
+
+def read_files(filepaths: List[str], mmap_threshold: int) -> List[Any]:
+    contents: List[Any] = []
+    for filepath in filepaths:
+        try:
+            contents.append(read_file(filepath, mmap_threshold))
+        except Exception as e:
+            contents.append(e)
+    return contents
+
+
+def buffer_size(filepath: str, mmap_threshold: int) -> int:
+    # Bytes a read will copy into memory, memory-mapped files are not copied
+    try:
+        size = os.stat(filepath).st_size
+    except OSError:
+        return 0  # Reported by the read
+    return size if size < mmap_threshold else 0
+
+
+class ReadBytes(Pipe):
+    def __init__(
+        self,
+        num_workers: int = 8,
+        max_buffer: int = 2**28,
+        mmap_threshold: int = 2**24,
+        group_size: int = 1,
+        with_path: bool = False,
+        handler: Callable = log_traceback_and_continue,
+    ) -> None:
+        assert num_workers > 0 and group_size > 0
+        self.num_workers = num_workers
+        self.max_buffer = max_buffer
+        self.mmap_threshold = mmap_threshold
+        self.group_size = group_size
+        self.with_path = with_path
+        self.handler = handler
+
+    def __call__(self, items: Iterable[str]) -> Iterator[Any]:  # type: ignore
+        # With group_size > 1, small files are read in groups to amortize the
+        # per-task overhead (each file still gets its own open/read). A group is only
+        # submitted once it is full, so slow sources should keep group_size=1
+        it = iter(items)
+        groups = iter(lambda: list(islice(it, self.group_size)), [])
+        group: Optional[List[str]] = None
+        sizes: List[int] = []
+        reserved = 0  # Bytes of submitted reads that were not yielded yet
+        pending: Deque[Tuple[List[str], List[int], Future]] = deque()
+        executor = ThreadPoolExecutor(self.num_workers)
+        completed = False
+        try:
+            while True:
+                while len(pending) < 2 * self.num_workers:
+                    if group is None:
+                        group = next(groups, None)
+                        if group is None:
+                            break
+                        sizes = [buffer_size(f, self.mmap_threshold) for f in group]
+                    # Reserve bytes before reading, unless nothing else is pending
+                    if pending and reserved + sum(sizes) > self.max_buffer:
+                        break
+                    future = executor.submit(read_files, group, self.mmap_threshold)
+                    pending.append((group, sizes, future))
+                    reserved += sum(sizes)
+                    group = None
+                if not pending:
+                    break
+                filepaths, filesizes, future = pending.popleft()
+                for filepath, size, content in zip(
+                    filepaths, filesizes, future.result()
+                ):
+                    reserved -= size
+                    if isinstance(content, Exception):
+                        self.handler(content)
+                    else:
+                        yield (filepath, content) if self.with_path else content
+            completed = True
+        finally:
+            executor.shutdown(wait=completed, cancel_futures=True)
@@ -1,17 +1,28 @@
-from typing import Dict, Iterable, Iterator, List, Sequence, Union
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Union
 
 from pipd import Pipe
 
+from .read_lines import open_text
+
 
 class ReadCSV(Pipe):
-    def __init__(self, header: Union[bool, Sequence[str]] = False) -> None:
+    def __init__(
+        self,
+        header: Union[bool, Sequence[str]] = False,
+        compression: Optional[str] = "auto",
+        threaded: bool = True,
+    ) -> None:
         self.header = header
+        self.compression = compression
+        self.threaded = threaded
 
     def __call__(self, items: Iterator[str]) -> Iterable[Union[Dict[str, str], List[str]]]:  # type: ignore # noqa
         import csv
 
         for filepath in items:
-            with open(filepath, "r") as f:
+            with open_text(
+                filepath, compression=self.compression, threaded=self.threaded
+            ) as f:
                 if self.header:
                     fieldnames = (
                         self.header if isinstance(self.header, Sequence) else None
@@ -1,11 +1,143 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+import queue
 import select
-from typing import Iterable, Iterator
+import stat
+import threading
+from typing import IO, Iterable, Iterator, Optional
 
 from pipd import Pipe
 
+COMPRESSION_EXTENSIONS = {".gz": "gzip", ".bz2": "bz2", ".xz": "xz", ".zst": "zstd"}
+COMPRESSION_MAGIC_BYTES = {
+    b"\x1f\x8b": "gzip",
+    b"\xfd7zXZ\x00": "xz",
+    b"\x28\xb5\x2f\xfd": "zstd",
+}
 
-def read_lines(filepath: str, watch: bool = False) -> Iterator[str]:
-    with open(filepath, "r") as file:
+
+def detect_compression(filepath: str) -> Optional[str]:
+    for extension, compression in COMPRESSION_EXTENSIONS.items():
+        if filepath.endswith(extension):
+            return compression
+    # Only sniff regular files, reading a pipe or FIFO would consume it
+    if not stat.S_ISREG(os.stat(filepath).st_mode):
+        return None
+    with open(filepath, "rb") as file:
+        head = file.read(6)
+    for magic, compression in COMPRESSION_MAGIC_BYTES.items():
+        if head.startswith(magic):
+            return compression
+    if head[:3] == b"BZh" and head[3:4].isdigit() and head[3:4] != b"0":
+        return "bz2"
+    return None
+
+
+def open_decompressed(filepath: str, compression: str) -> io.BufferedIOBase:
+    if compression == "gzip":
+        return gzip.open(filepath, "rb")
+    if compression == "bz2":
+        return bz2.open(filepath, "rb")
+    if compression == "xz":
+        return lzma.open(filepath, "rb")
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstandard is required to read .zst files")
+        return zstandard.ZstdDecompressor().stream_reader(open(filepath, "rb"))
+    raise ValueError(f"Unknown compression '{compression}'")
+
+
+class ThreadedReader(io.RawIOBase):
+    """Reads `file` in chunks on a background thread, so that decompression
+    overlaps with whatever consumes the stream."""
+
+    def __init__(
+        self, file: io.BufferedIOBase, chunk_size: int = 2**20, prefetch: int = 4
+    ):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.chunks: queue.Queue = queue.Queue(maxsize=prefetch)
+        self.chunk = memoryview(b"")
+        self.eof = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._fill, daemon=True)
+        self.thread.start()
+
+    def _put(self, chunk) -> None:
+        while not self.stopped.is_set():
+            try:
+                self.chunks.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _fill(self) -> None:
+        try:
+            while not self.stopped.is_set():
+                chunk = self.file.read(self.chunk_size)
+                self._put(chunk)
+                if not chunk:
+                    return
+        except Exception as e:
+            self._put(e)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:  # type: ignore
+        if self.eof:
+            return 0
+        if not self.chunk:
+            chunk = self.chunks.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if not chunk:
+                self.eof = True
+                return 0
+            self.chunk = memoryview(chunk)
+        size = min(len(buffer), len(self.chunk))
+        buffer[:size] = self.chunk[:size]
+        self.chunk = self.chunk[size:]
+        return size
+
+    def close(self) -> None:
+        if not self.closed:
+            self.stopped.set()
+            self.thread.join()
+            self.file.close()
+        super().close()
+
+
+def open_text(
+    filepath: str,
+    compression: Optional[str] = "auto",
+    threaded: bool = True,
+) -> IO[str]:
+    if compression == "auto":
+        compression = detect_compression(filepath)
+    if compression is None:
+        return open(filepath, "r")
+    file = open_decompressed(filepath, compression)
+    if threaded:
+        file = io.BufferedReader(ThreadedReader(file))
+    return io.TextIOWrapper(file)  # type: ignore
+
+
+def read_lines(
+    filepath: str,
+    watch: bool = False,
+    compression: Optional[str] = "auto",
+    threaded: bool = True,
+) -> Iterator[str]:
+    if watch:
+        assert compression in ["auto", None], "watch only works on uncompressed files"
+        compression = None
+    with open_text(filepath, compression=compression, threaded=threaded) as file:
         if watch:
             while True:
                 line = file.readline()
@@ -21,9 +153,21 @@ def read_lines(filepath: str, watch: bool = False) -> Iterator[str]:
 
 
 class ReadLines(Pipe):
-    def __init__(self, watch: bool = False) -> None:
+    def __init__(
+        self,
+        watch: bool = False,
+        compression: Optional[str] = "auto",
+        threaded: bool = True,
+    ) -> None:
         self.watch = watch
+        self.compression = compression
+        self.threaded = threaded
 
     def __call__(self, items: Iterable[str]) -> Iterator[str]:  # type: ignore
         for filepath in items:
-            yield from read_lines(filepath=filepath, watch=self.watch)
+            yield from read_lines(
+                filepath=filepath,
+                watch=self.watch,
+                compression=self.compression,
+                threaded=self.threaded,
+            )
@@ -0,0 +1,136 @@
+import mmap
+import os
+import random
+import sys
+from array import array
+from bisect import bisect_right
+from typing import Any, Iterable, Iterator, List, Optional, Sequence
+
+from pipd import Pipe
+
+from .write_records import LENGTH, get_serializer, index_filepath
+
+
+def build_index(data: Any) -> array:
+    offsets = array("Q")
+    offset = 0
+    while offset < len(data):
+        offsets.append(offset)
+        offset += LENGTH.size + LENGTH.unpack_from(data, offset)[0]
+    return offsets
+
+
+def permutation(start: int, end: int, rng: random.Random) -> Sequence[int]:
+    """Shuffled range(start, end) stored as 8-byte ints, not a list of ints."""
+    try:
+        import numpy as np
+    except ImportError:
+        indices = array("Q", range(start, end))
+        for i in range(len(indices) - 1, 0, -1):  # Fisher-Yates
+            j = rng.randrange(i + 1)
+            indices[i], indices[j] = indices[j], indices[i]
+        return indices
+    generator = np.random.default_rng(rng.getrandbits(64))
+    shuffled = np.arange(start, end, dtype=np.uint64)
+    generator.shuffle(shuffled)
+    return array("Q", shuffled.tobytes())
+
+
+def map_file(filepath: str) -> Any:
+    with open(filepath, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class Records(Sequence):
+    """Memory-mapped random access to a file written by `WriteRecords`."""
+
+    def __init__(self, filepath: str, format: str = "pickle") -> None:
+        self.filepath = filepath
+        self.format = format
+        self.open()
+
+    def open(self) -> None:
+        _, self.decode = get_serializer(self.format)
+        self.data = map_file(self.filepath)
+        self.index_data = None
+        if not os.path.exists(index_filepath(self.filepath)):
+            self.offsets: Any = build_index(self.data)
+        elif sys.byteorder == "little":
+            self.index_data = map_file(index_filepath(self.filepath))
+            self.offsets = memoryview(self.index_data).cast("Q")
+        else:
+            self.offsets = array("Q")
+            with open(index_filepath(self.filepath), "rb") as file:
+                self.offsets.frombytes(file.read())
+            self.offsets.byteswap()
+
+    def close(self) -> None:
+        if isinstance(self.offsets, memoryview):
+            self.offsets.release()
+        for file in [self.data, self.index_data]:
+            if isinstance(file, mmap.mmap):
+                file.close()
+
+    def __enter__(self) -> "Records":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __getstate__(self):
+        # Workers re-map the file instead of copying its content
+        return dict(filepath=self.filepath, format=self.format)
+
+    def __setstate__(self, state) -> None:
+        self.__dict__.update(state)
+        self.open()
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, i: int) -> Any:  # type: ignore
+        offset = self.offsets[i]
+        (length,) = LENGTH.unpack_from(self.data, offset)
+        start = offset + LENGTH.size
+        return self.decode(self.data[start : start + length])
+
+
+class ReadRecords(Pipe):
+    def __init__(
+        self,
+        format: str = "pickle",
+        shuffle: bool = False,
+        shard: int = 0,
+        num_shards: int = 1,
+        seed: Optional[int] = None,
+    ) -> None:
+        assert format in ["pickle", "msgpack", "raw"]
+        assert 0 <= shard < num_shards
+        self.format = format
+        self.shuffle = shuffle
+        self.shard = shard
+        self.num_shards = num_shards
+        self.random = random.Random(seed)
+
+    def __call__(self, items: Iterable[str]) -> Iterator[Any]:  # type: ignore
+        files: List[Records] = []
+        try:
+            ends: List[int] = []
+            for filepath in items:
+                files.append(Records(filepath, format=self.format))
+                ends.append((ends[-1] if ends else 0) + len(files[-1]))
+            total = ends[-1] if ends else 0
+            # Range sharding over the global index of all files
+            start = total * self.shard // self.num_shards
+            end = total * (self.shard + 1) // self.num_shards
+            indices: Sequence[int] = range(start, end)
+            if self.shuffle:
+                indices = permutation(start, end, self.random)
+            for i in indices:
+                file_id = bisect_right(ends, i)
+                yield files[file_id][i - (ends[file_id - 1] if file_id else 0)]
+        finally:
+            for file in files:
+                file.close()
@@ -1,15 +1,69 @@
-from typing import Iterable, Iterator, TypeVar
+import os
+import pickle
+import random
+import tempfile
+from typing import Iterable, Iterator, List, Optional, Sequence, TypeVar
 
 from pipd import Pipe
 
+from .read_records import Records, permutation
+from .write_records import LENGTH
+
 T = TypeVar("T")
 
 
 class Repeat(Pipe):
-    def __init__(self, num: int = 10**10) -> None:
+    def __init__(
+        self,
+        num: int = 10**10,
+        cache: bool = False,
+        max_memory: int = 2**30,
+        cache_dir: Optional[str] = None,
+        shuffle: bool = False,
+    ) -> None:
+        assert cache or not shuffle, "shuffle only works with cache=True"
         self.num = num
+        self.cache = cache
+        self.max_memory = max_memory
+        self.cache_dir = cache_dir
+        self.shuffle = shuffle
 
     def __call__(self, items: Iterable[T]) -> Iterator[T]:  # type: ignore
-        for _ in range(self.num):
-            for item in items:
-                yield item
+        if not self.cache:
+            for _ in range(self.num):
+                for item in items:
+                    yield item
+            return
+        if self.num == 0:
+            return
+
+        # First epoch: record pickled items in memory, spill to disk past max_memory
+        memory: List[bytes] = []
+        size = 0
+        fd, filepath = tempfile.mkstemp(suffix=".records", dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, "wb") as file:
+                for item in items:
+                    data = pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+                    size += len(data)
+                    if size <= self.max_memory:
+                        memory.append(data)
+                    else:
+                        file.write(LENGTH.pack(len(data)))
+                        file.write(data)
+                    yield item
+
+            # Next epochs: replay from memory and the memory-mapped spill file
+            with Records(filepath) as disk:
+                total = len(memory) + len(disk)
+                for _ in range(self.num - 1):
+                    indices: Sequence[int] = range(total)
+                    if self.shuffle:
+                        indices = permutation(0, total, random.Random())
+                    for i in indices:
+                        if i < len(memory):
+                            yield pickle.loads(memory[i])
+                        else:
+                            yield disk[i - len(memory)]
+        finally:
+            os.remove(filepath)
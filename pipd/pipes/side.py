@@ -1,8 +1,9 @@
-from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import Callable, Iterable, Iterator, TypeVar
 
 from pipd import Pipe, log_traceback_and_continue
 
+from .map import call_worker, create_executor
+
 T = TypeVar("T")
 U = TypeVar("U")
 
@@ -31,10 +32,15 @@ class Side(Pipe):
                 yield item
             return
 
-        executors = dict(
-            multithread=ThreadPoolExecutor, multiprocess=ProcessPoolExecutor
-        )
-        with executors[self.mode](max_workers=self.num_workers) as executor:
+        executor, cancelled = create_executor(self.mode, self.num_workers, self.fn)
+        completed = False
+        try:
             for item in items:
-                executor.submit(self.fn, item)
+                executor.submit(call_worker, item)
                 yield item
+            completed = True
+        finally:
+            # Closed early: drop queued tasks and signal running ones
+            if not completed:
+                cancelled.set()
+            executor.shutdown(wait=completed, cancel_futures=not completed)
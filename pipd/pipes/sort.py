@@ -0,0 +1,126 @@
+import heapq
+import mmap
+import os
+import pickle
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from operator import itemgetter
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Set, Tuple
+
+from pipd import Pipe
+
+from .read_records import build_index, map_file
+from .write_records import LENGTH
+
+
+def write_blobs(blobs: Iterable[bytes], filepath: str) -> None:
+    with open(filepath, "wb") as file:
+        for data in blobs:
+            file.write(LENGTH.pack(len(data)))
+            file.write(data)
+
+
+def write_run(run: List[Tuple[Any, bytes]], filepath: str, reverse: bool) -> str:
+    run.sort(key=itemgetter(0), reverse=reverse)
+    write_blobs((data for _, data in run), filepath)
+    return filepath
+
+
+def sort_run(source: str, keys: List[Any], filepath: str, reverse: bool) -> str:
+    # Reorders the records of an unsorted spill file by key, without unpickling
+    data = map_file(source)
+    try:
+        offsets = build_index(data)
+        order = sorted(range(len(keys)), key=keys.__getitem__, reverse=reverse)
+        with open(filepath, "wb") as file:
+            for i in order:
+                (length,) = LENGTH.unpack_from(data, offsets[i])
+                file.write(data[offsets[i] : offsets[i] + LENGTH.size + length])
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+    os.remove(source)
+    return filepath
+
+
+def read_run(filepath: str) -> Iterator[Any]:
+    with open(filepath, "rb") as file:
+        while True:
+            length = file.read(LENGTH.size)
+            if not length:
+                return
+            yield pickle.loads(file.read(LENGTH.unpack(length)[0]))
+
+
+class Sort(Pipe):
+    def __init__(
+        self,
+        key: Optional[Callable] = None,
+        reverse: bool = False,
+        max_memory: int = 2**30,
+        num_workers: int = 0,
+        tmp_dir: Optional[str] = None,
+    ) -> None:
+        self.key = key
+        self.reverse = reverse
+        self.max_memory = max_memory
+        self.num_workers = num_workers
+        self.tmp_dir = tmp_dir
+
+    def __call__(self, items: Iterable[Any]) -> Iterator[Any]:  # type: ignore
+        key = self.key or (lambda x: x)
+        run: List[Tuple[Any, bytes]] = []
+        size = 0
+        filepaths: List[str] = []
+        futures: Set[Future] = set()
+        readers: List[Iterator[Any]] = []
+        executor = ProcessPoolExecutor(self.num_workers) if self.num_workers else None
+
+        with tempfile.TemporaryDirectory(dir=self.tmp_dir) as directory:
+            try:
+                for item in items:
+                    data = pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+                    run.append((key(item), data))
+                    size += len(data)
+                    if size < self.max_memory:
+                        continue
+                    # Spill sorted run to disk, sorted on a worker process if available
+                    filepath = os.path.join(directory, f"{len(filepaths)}.run")
+                    filepaths.append(filepath)
+                    if executor is None:
+                        write_run(run, filepath, self.reverse)
+                    else:
+                        if len(futures) >= self.num_workers:
+                            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                            for future in done:
+                                future.result()
+                        # Only keys go to the worker, items are spilled unsorted
+                        write_blobs((data for _, data in run), filepath + ".unsorted")
+                        keys = [item_key for item_key, _ in run]
+                        futures.add(
+                            executor.submit(
+                                sort_run,
+                                filepath + ".unsorted",
+                                keys,
+                                filepath,
+                                self.reverse,
+                            )
+                        )
+                    run, size = [], 0
+
+                run.sort(key=itemgetter(0), reverse=self.reverse)
+                for future in futures:
+                    future.result()
+                if not filepaths:
+                    for _, data in run:
+                        yield pickle.loads(data)
+                    return
+
+                readers = [read_run(filepath) for filepath in filepaths]
+                readers.append(pickle.loads(data) for _, data in run)
+                yield from heapq.merge(*readers, key=key, reverse=self.reverse)
+            finally:
+                for reader in readers:
+                    reader.close()  # type: ignore
+                if executor is not None:
+                    executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,72 @@
+import queue
+import threading
+from typing import Callable, Iterable, Iterator, TypeVar
+
+from pipd import Pipe, log_traceback_and_continue
+
+T = TypeVar("T")
+
+DONE = object()
+
+
+class Branch:
+    """Runs `pipe` on a thread, fed through a bounded queue."""
+
+    def __init__(self, pipe: Pipe, buffer: int, handler: Callable) -> None:
+        self.pipe = pipe
+        self.handler = handler
+        self.queue: queue.Queue = queue.Queue(maxsize=buffer)
+        self.finished = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def items(self) -> Iterator:
+        while True:
+            item = self.queue.get()
+            if item is DONE:
+                return
+            yield item
+
+    def run(self) -> None:
+        try:
+            for _ in self.pipe(self.items()):
+                pass
+        except Exception as e:
+            self.handler(e)
+        finally:
+            self.finished.set()
+
+    def put(self, item) -> None:
+        # Stop feeding a branch that returned early or failed
+        while not self.finished.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+
+class Tee(Pipe):
+    def __init__(
+        self,
+        *pipes: Pipe,
+        buffer: int = 128,
+        handler: Callable = log_traceback_and_continue,
+    ) -> None:
+        self.pipes = pipes
+        self.buffer = buffer
+        self.handler = handler
+
+    def __call__(self, items: Iterable[T]) -> Iterator[T]:  # type: ignore
+        branches = [Branch(pipe, self.buffer, self.handler) for pipe in self.pipes]
+        try:
+            for item in items:
+                for branch in branches:
+                    branch.put(item)
+                yield item
+        finally:
+            # Let branches flush what they received (e.g. close written files)
+            for branch in branches:
+                branch.put(DONE)
+            for branch in branches:
+                branch.thread.join()
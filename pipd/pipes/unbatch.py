@@ -8,5 +8,10 @@ T = TypeVar("T")
 class Unbatch(Pipe):
     def __call__(self, items: Iterable[Sequence[T]]) -> Iterator[T]:  # type: ignore
         for b in items:
+            if isinstance(b, dict):
+                # Columnar batch (e.g. from a batched Map): rows are built lazily
+                for values in zip(*b.values()):
+                    yield dict(zip(b, values))  # type: ignore
+                continue
             for item in b:
                 yield item
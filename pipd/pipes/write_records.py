@@ -0,0 +1,60 @@
+import pickle
+import struct
+from typing import Any, Callable, Iterable, Iterator, Tuple, TypeVar
+
+from pipd import Pipe
+
+T = TypeVar("T")
+
+LENGTH = struct.Struct("<Q")
+
+
+def index_filepath(filepath: str) -> str:
+    return filepath + ".idx"
+
+
+def encode_raw(item: Any) -> bytes:
+    if not isinstance(item, (bytes, bytearray, memoryview)):
+        raise TypeError(f"format='raw' expects bytes, got {type(item).__name__}")
+    return bytes(item)
+
+
+def get_serializer(
+    format: str,
+) -> Tuple[Callable[[Any], bytes], Callable[[bytes], Any]]:
+    if format == "pickle":
+        return lambda x: pickle.dumps(x, protocol=pickle.HIGHEST_PROTOCOL), pickle.loads
+    if format == "msgpack":
+        try:
+            import msgpack
+        except ImportError:
+            raise ImportError("msgpack is required to use format='msgpack'")
+        return msgpack.packb, msgpack.unpackb
+    if format == "raw":
+        return encode_raw, lambda x: x
+    raise ValueError(f"Unknown record format '{format}'")
+
+
+def write_records(
+    items: Iterable[T], filepath: str, format: str = "pickle"
+) -> Iterator[T]:
+    encode, _ = get_serializer(format)
+    offset = 0
+    with open(filepath, "wb") as file, open(index_filepath(filepath), "wb") as index:
+        for item in items:
+            data = encode(item)
+            file.write(LENGTH.pack(len(data)))
+            file.write(data)
+            index.write(LENGTH.pack(offset))
+            offset += LENGTH.size + len(data)
+            yield item
+
+
+class WriteRecords(Pipe):
+    def __init__(self, filepath: str, format: str = "pickle") -> None:
+        assert format in ["pickle", "msgpack", "raw"]
+        self.filepath = filepath
+        self.format = format
+
+    def __call__(self, items: Iterable[T]) -> Iterator[T]:  # type: ignore
+        return write_records(items, self.filepath, self.format)
@@ -17,6 +17,281 @@ def test_map():
     pipe = Pipe(range(5)).map(double, num_workers=2, mode="multiprocess")
     assert sorted(pipe) == [0, 2, 4, 6, 8]
 
+    pipe = Pipe(range(50)).map(double, num_workers="auto", max_workers=4)
+    assert sorted(pipe) == [x * 2 for x in range(50)]
+
+
+def load_offset():
+    import os
+
+    return {"offset": 10, "pid": os.getpid()}
+
+
+def add_offset(x, state):
+    return x + state["offset"], state["pid"]
+
+
+def test_map_init_fn():
+    import os
+
+    pipe = Pipe(range(3)).map(add_offset, init_fn=load_offset)
+    assert list(pipe) == [(10, os.getpid()), (11, os.getpid()), (12, os.getpid())]
+
+    pipe = Pipe(range(3)).map(add_offset, init_fn=load_offset, num_workers=2)
+    assert sorted(x for x, _ in pipe) == [10, 11, 12]
+
+    inits = []
+    pipe = Pipe(range(10)).map(
+        lambda x, state: x + state, num_workers=2, init_fn=lambda: inits.append(0) or 1
+    )
+    assert sorted(pipe) == list(range(1, 11))
+    assert len(inits) <= 2
+
+    pipe = Pipe(range(20)).map(
+        add_offset, init_fn=load_offset, num_workers=2, mode="multiprocess"
+    )
+    results = list(pipe)
+    assert sorted(x for x, _ in results) == list(range(10, 30))
+    assert len({pid for _, pid in results}) <= 2
+    assert os.getpid() not in {pid for _, pid in results}
+
+    pipe = Pipe(range(5)).filter(lambda x, state: x > state, init_fn=lambda: 2)
+    assert list(pipe) == [3, 4]
+
+
+def sleep_and_return(x):
+    import time
+
+    time.sleep(30.0 if x < 2 else 0.01)
+    return x
+
+
+def log_init(log):
+    with open(log, "a") as f:
+        f.write("init\n")
+    return log
+
+
+def log_and_hang_on_zero(x, log):
+    import os
+    import time
+
+    with open(log, "a") as f:
+        f.write(f"{x}\n")
+    if x == 0:
+        time.sleep(30.0)
+    elif x == 1:
+        time.sleep(0.2)
+    elif x == 2:  # Still running when 0 times out
+        while not os.path.exists(log + ".timeout"):
+            time.sleep(0.01)
+    return x
+
+
+def test_map_timeout_restarts_processes(tmp_path):
+    from functools import partial
+
+    # A hung process is killed once the healthy calls in flight have finished, so
+    # none of them runs twice. Workers of the new pool run init_fn again
+    log = str(tmp_path / "log")
+    errors = []
+
+    def handler(e):
+        errors.append(e)
+        open(log + ".timeout", "w").close()
+
+    pipe = Pipe(range(6)).map(
+        log_and_hang_on_zero,
+        num_workers=2,
+        mode="multiprocess",
+        timeout=0.5,
+        init_fn=partial(log_init, log),
+        handler=handler,
+    )
+    assert sorted(pipe) == [1, 2, 3, 4, 5]
+    assert len(errors) == 1 and isinstance(errors[0], TimeoutError)
+    with open(log) as f:
+        lines = f.read().split()
+    assert sorted(line for line in lines if line != "init") == list("012345")
+    assert 2 < lines.count("init") <= 4
+
+
+def wait_until(condition, timeout=10.0):
+    import time
+
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_map_timeout_retries_hedge():
+    import threading
+    import time
+
+    # Items waiting for a worker are not on the timeout clock
+    errors = []
+    pipe = Pipe(range(10)).map(
+        lambda x: time.sleep(0.05) or x,
+        num_workers=1,
+        buffer=10,
+        timeout=0.3,
+        handler=errors.append,
+    )
+    assert sorted(pipe) == list(range(10)) and errors == []
+
+    # More hung calls than workers: replacement workers run the healthy items.
+    # Hung threads wait on an event, hung processes are killed
+    release = threading.Event()
+
+    def wait_and_return(x):
+        if x < 2:
+            release.wait()
+        return x
+
+    for fn, mode in [
+        (wait_and_return, "multithread"),
+        (sleep_and_return, "multiprocess"),
+    ]:
+        pipe = Pipe(range(8)).map(
+            fn, num_workers=2, timeout=0.5, mode=mode, handler=errors.append
+        )
+        assert sorted(pipe) == list(range(2, 8))
+        assert len(errors) == 2 and all(isinstance(e, TimeoutError) for e in errors)
+        errors.clear()
+
+    def hang_on_one(x):
+        if x == 1:
+            release.wait()
+        return x
+
+    pipe = Pipe(range(4)).map(
+        hang_on_one, num_workers=4, timeout=0.1, handler=errors.append
+    )
+    assert sorted(pipe) == [0, 2, 3]
+    assert len(errors) == 1 and isinstance(errors[0], TimeoutError)
+
+    attempts = {}
+
+    def flaky(x):
+        attempts[x] = attempts.get(x, 0) + 1
+        if attempts[x] < 3:
+            raise ValueError(x)
+        return x
+
+    pipe = Pipe(range(3)).map(flaky, num_workers=2, retries=2, backoff=0.01)
+    assert sorted(pipe) == [0, 1, 2]
+    attempts.clear()
+    pipe = Pipe(range(3)).map(flaky, retries=2)
+    assert list(pipe) == [0, 1, 2]
+    attempts.clear()
+    errors.clear()
+    pipe = Pipe(range(3)).map(flaky, num_workers=2, retries=1, handler=errors.append)
+    assert list(pipe) == [] and len(errors) == 3
+
+    # The first call of 20 only returns once the test ends, so the hedge answers it
+    calls = []
+
+    def slow_first_call(x):
+        calls.append(x)
+        if x == 20 and calls.count(x) == 1:
+            release.wait()
+        return x
+
+    pipe = Pipe(range(30)).map(slow_first_call, num_workers=4, hedge=0.9)
+    assert sorted(pipe) == list(range(30))
+    assert calls.count(20) == 2
+    release.set()
+
+
+def test_cancellation():
+    import time
+
+    from pipd import is_cancelled
+
+    started, stopped = [], []
+
+    def slow(x):
+        started.append(x)
+        for _ in range(1000 if x > 0 else 0):
+            if is_cancelled():
+                stopped.append(x)
+                return x
+            time.sleep(0.01)
+        return x
+
+    # Running tasks are stopped, queued ones are cancelled
+    pipe = Pipe(range(100)).map(slow, num_workers=4, buffer=50).limit(1)
+    assert list(pipe) == [0]
+    assert wait_until(lambda: len(stopped) == len(started) - 1)
+    assert 1 <= len(stopped) <= 4
+
+    pipe = Pipe(range(100)).side(slow, num_workers=2)
+    for _ in pipe:
+        break
+    started.clear()
+    stopped.clear()
+    pipe = Pipe(range(100)).side(slow, num_workers=2).limit(10)
+    assert list(pipe) == list(range(10))
+    assert wait_until(lambda: len(stopped) == len(started) - (0 in started))
+    assert 1 <= len(stopped) <= 2
+
+
+def test_adaptive_limit():
+    from pipd.pipes.map import AdaptiveLimit
+
+    limit = AdaptiveLimit(min_limit=1, max_limit=4, window=2)
+    for _ in range(100):
+        limit.update(0.01)
+    assert limit.limit == 4
+    for _ in range(8):
+        limit.update(1.0)
+    assert limit.limit == 1
+
+    # Failures halve the limit, once per round of in-flight tasks
+    limit = AdaptiveLimit(min_limit=1, max_limit=8)
+    limit.limit = 8
+    for _ in range(8):
+        limit.decrease()
+    assert limit.limit == 4
+    for _ in range(4):
+        limit.decrease()
+    assert limit.limit == 2
+
+    with pytest.raises(AssertionError):
+        Pipe.map(double, num_workers="auto", buffer=4)
+
+
+def test_map_batched():
+    np = pytest.importorskip("numpy")
+
+    pipe = Pipe(range(5)).batch(2).map(lambda x: x * 2, batched=True)
+    assert [list(map(int, b)) for b in pipe] == [[0, 2], [4, 6], [8]]
+
+    items = [{"a": i, "b": float(i)} for i in range(4)]
+    pipe = (
+        Pipe(items)
+        .batch(3)
+        .map(lambda x: {"c": x["a"] + x["b"]}, batched=True, num_workers=2)
+    )
+    assert sorted(float(x["c"]) for x in pipe.unbatch()) == [0.0, 2.0, 4.0, 6.0]
+
+    # Outputs stay columnar between batched stages, or are split with uncollate
+    pipe = Pipe(range(4)).batch(2).map(lambda x: x + 1, batched=True)
+    pipe = pipe.map(lambda x: x * 2, batched=True)
+    assert all(isinstance(b, np.ndarray) for b in pipe)
+    assert [int(x) for x in pipe.unbatch()] == [2, 4, 6, 8]
+
+    pipe = Pipe(range(3)).batch(2).map(lambda x: x + 1, batched=True, uncollate=True)
+    assert list(pipe) == [[1, 2], [3]]
+
+    pipe = Pipe([[1, 2], [3]]).map(lambda x: len(x), batched=True, collate=False)
+    assert list(pipe) == [2, 1]
+
+    # Already collated batches are passed as is
+    pipe = Pipe([np.arange(3)]).map(lambda x: x + 1, batched=True)
+    assert [list(b) for b in pipe] == [[1, 2, 3]]
+
 
 def test_map_key():
     pipe = Pipe([{"a": 1}, {"a": 2}, {"a": 3}]).map_key("a", lambda x: x * 2)
@@ -31,6 +306,20 @@ def test_filter():
     assert sorted(pipe) == [0, 2, 4]
 
 
+def test_filter_batched():
+    np = pytest.importorskip("numpy")
+
+    pipe = Pipe(range(7)).batch(3).filter(lambda x: x % 2 == 0, batched=True)
+    assert list(pipe) == [[0, 2], [4], [6]]
+
+    items = [{"a": i} for i in range(4)]
+    pipe = Pipe(items).batch(2).filter(lambda x: x["a"] > 1, batched=True)
+    assert list(pipe) == [[{"a": 2}, {"a": 3}]]
+
+    pipe = Pipe([{"a": np.arange(4)}]).filter(lambda x: x["a"] < 2, batched=True)
+    assert [list(b["a"]) for b in pipe] == [[0, 1]]
+
+
 def test_side():
     pipe = Pipe(range(5)).side(lambda x: x * 2)
     assert list(pipe) == [0, 1, 2, 3, 4]
@@ -38,6 +327,16 @@ def test_side():
     pipe = Pipe(range(5)).side(lambda x: x * 2, num_workers=2)
     assert list(pipe) == [0, 1, 2, 3, 4]
 
+    # Queued side effects still run once the pipe is exhausted
+    import time
+
+    seen = []
+    pipe = Pipe(range(50)).side(
+        lambda x: time.sleep(0.01) or seen.append(x), num_workers=2
+    )
+    assert list(pipe) == list(range(50))
+    assert sorted(seen) == list(range(50))
+
 
 def test_batch():
     pipe = Pipe(range(5)).batch(2)
@@ -66,6 +365,36 @@ def test_repeat():
     pipe = Pipe(range(5)).repeat(2)
     assert list(pipe) == [0, 1, 2, 3, 4, 0, 1, 2, 3, 4]
 
+    # Generators can only be iterated once, cache replays them
+    pipe = Pipe(x for x in range(5)).repeat(2)
+    assert list(pipe) == [0, 1, 2, 3, 4]
+    pipe = Pipe(x for x in range(5)).repeat(3, cache=True)
+    assert list(pipe) == [0, 1, 2, 3, 4] * 3
+    pipe = Pipe(x for x in range(5)).repeat(3, cache=True, max_memory=20)
+    assert list(pipe) == [0, 1, 2, 3, 4] * 3
+    pipe = Pipe(x for x in range(50)).repeat(2, cache=True, shuffle=True)
+    result = list(pipe)
+    assert result[:50] == list(range(50))
+    assert result[50:] != list(range(50)) and sorted(result[50:]) == list(range(50))
+
+
+def test_sort():
+    import random
+
+    items = [random.randint(0, 100) for _ in range(200)]
+    assert list(Pipe(items).sort()) == sorted(items)
+    assert list(Pipe(items).sort(max_memory=100)) == sorted(items)
+    pipe = Pipe(items).sort(reverse=True, max_memory=100, num_workers=2)
+    assert list(pipe) == sorted(items, reverse=True)
+
+    # Stable, and yields incrementally
+    items = [{"k": x % 3, "i": i} for i, x in enumerate(range(50))]
+    pipe = Pipe(items).sort(key=lambda x: x["k"], max_memory=200)
+    assert list(pipe) == sorted(items, key=lambda x: x["k"])
+    it = iter(Pipe(items).sort(key=lambda x: x["k"], max_memory=200))
+    assert next(it) == items[0]
+    it.close()
+
 
 def test_read_lines():
     import os
@@ -78,6 +407,29 @@ def test_read_lines():
         assert list(pipe) == ["1", "2", "3", "4", "5"]
         os.remove(f.name)
 
+    # Test compressed
+    import bz2
+    import gzip
+    import lzma
+
+    with tempfile.TemporaryDirectory() as d:
+        files = [("f.gz", gzip.open), ("f.bz2", bz2.open), ("f", lzma.open)]
+        for name, opener in files:
+            with opener(os.path.join(d, name), "wt") as f:
+                f.write("1\n2\n3\n4\n5")
+            pipe = Pipe([os.path.join(d, name)]).read_lines()
+            assert list(pipe) == ["1", "2", "3", "4", "5"]
+            pipe = Pipe([os.path.join(d, name)]).read_lines(threaded=False)
+            assert list(pipe) == ["1", "2", "3", "4", "5"]
+
+    # Pipes are not consumed by compression detection
+    read_fd, write_fd = os.pipe()
+    with os.fdopen(write_fd, "w") as f:
+        f.write("1\n2\n")
+    pipe = Pipe([f"/dev/fd/{read_fd}"]).read_lines()
+    assert list(pipe) == ["1", "2"]
+    os.close(read_fd)
+
 
 def test_write_lines():
     import os
@@ -114,6 +466,15 @@ def test_read_csv():
         assert list(pipe) == [["1", "2", "3", "4", "5"], ["6", "7", "8", "9", "10"]]
         os.remove(f.name)
 
+    # Test compressed
+    import gzip
+
+    with tempfile.TemporaryDirectory() as d:
+        with gzip.open(os.path.join(d, "f.csv.gz"), "wt") as f:
+            f.write("a,b\n1,2\n3,4")
+        pipe = Pipe([os.path.join(d, "f.csv.gz")]).read_csv(header=True)
+        assert list(pipe) == [{"a": "1", "b": "2"}, {"a": "3", "b": "4"}]
+
 
 def test_write_csv():
     import os
@@ -182,6 +543,155 @@ def test_read_files():
         os.remove(f2.name)
 
 
+def test_join():
+    import os
+    import pickle
+    import tempfile
+
+    from pipd import JoinIndex
+
+    with tempfile.TemporaryDirectory() as d:
+        filepath = os.path.join(d, "lookup.csv")
+        with open(filepath, "w") as f:
+            f.write("id,name\n1,a\n2,b\n2,c\n")
+        items = [{"id": 1}, {"id": 2}, {"id": 3}]
+
+        pipe = Pipe(items).join(filepath, key="id")
+        assert list(pipe) == [
+            {"id": "1", "name": "a"},
+            {"id": "2", "name": "b"},
+            {"id": "2", "name": "c"},
+        ]
+        pipe = Pipe(items).join(filepath, key="id", how="left")
+        assert list(pipe)[-1] == {"id": 3}
+        pipe = Pipe([1, 3]).join(filepath, key="id", on=lambda x: x, how="left")
+        assert list(pipe) == [(1, {"id": "1", "name": "a"}), (3, None)]
+        pipe = Pipe([items[:2], items[2:]]).join(filepath, key="id", batched=True)
+        assert [len(batch) for batch in pipe] == [3, 0]
+
+        # Index on disk, memory-mapped and shared by pickling
+        index_filepath = os.path.join(d, "lookup.idx")
+        pipe = Pipe(items).join(filepath, key="id", index_filepath=index_filepath)
+        assert len(list(pipe)) == 3 and os.path.exists(index_filepath)
+        index = JoinIndex(filepath, key="id", index_filepath=index_filepath)
+        assert pickle.loads(pickle.dumps(index)).get(2) == index.get(2)
+        index.close()
+
+        # A stale index (changed lookup file or key) is rebuilt
+        with open(filepath, "w") as f:
+            f.write("name,id\nd,2\nb,1\n")
+        index = JoinIndex(filepath, key="id", index_filepath=index_filepath)
+        assert index.get(2) == [{"name": "d", "id": "2"}]
+        index.close()
+        index = JoinIndex(filepath, key="name", index_filepath=index_filepath)
+        assert index.get("b") == [{"name": "b", "id": "1"}] and index.get(2) == []
+        index.close()
+        # Callable keys are told apart by their code, not just their name
+        by_id, by_name = lambda row: row["id"], lambda row: row["name"]
+        index = JoinIndex(filepath, key=by_id, index_filepath=index_filepath)
+        assert index.get("2") == [{"name": "d", "id": "2"}]
+        index.close()
+        index = JoinIndex(filepath, key=by_name, index_filepath=index_filepath)
+        assert index.get("b") == [{"name": "b", "id": "1"}] and index.get("2") == []
+        index.close()
+
+        filepath = os.path.join(d, "lookup.txt")
+        with open(filepath, "w") as f:
+            f.write("a\nb\n")
+        pipe = Pipe(["a", "c"]).join(filepath, format="lines", how="left")
+        assert list(pipe) == [("a", "a"), ("c", None)]
+        index = JoinIndex(filepath, format="lines")
+        assert pickle.loads(pickle.dumps(index)).get("b") == ["b"]
+
+
+def test_read_bytes():
+    import mmap
+    import os
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as d:
+        filepaths = []
+        for i in range(40):
+            filepaths.append(os.path.join(d, f"{i}.bin"))
+            with open(filepaths[-1], "wb") as f:
+                f.write(bytes([i]) * (i + 1))
+
+        pipe = Pipe(filepaths).read_bytes(num_workers=2, group_size=3)
+        assert list(pipe) == [bytes([i]) * (i + 1) for i in range(40)]
+        pipe = Pipe(filepaths).read_bytes(max_buffer=10, with_path=True)
+        expected = [(f, bytes([i]) * (i + 1)) for i, f in enumerate(filepaths)]
+        assert list(pipe) == expected
+
+        pipe = Pipe(filepaths[-1:]).read_bytes(mmap_threshold=10)
+        (content,) = list(pipe)
+        assert isinstance(content, mmap.mmap) and content[:] == bytes([39]) * 40
+
+        # Read-ahead is bounded by max_buffer, including reads in flight
+        import pipd.pipes.read_bytes as read_bytes
+
+        reads = []
+        read_file = read_bytes.read_file
+        read_bytes.read_file = lambda *args: reads.append(1) or read_file(*args)
+        try:
+            pipe = Pipe(filepaths[20:]).read_bytes(max_buffer=100, group_size=1)
+            for i, _ in enumerate(pipe):
+                assert len(reads) - i <= 4  # At most 100 bytes of 21+ byte files
+        finally:
+            read_bytes.read_file = read_file
+
+        # Paths are read as they arrive, not held back for a group
+        import threading
+
+        first_read = threading.Event()
+        waited = []
+
+        def slow_source():
+            yield filepaths[0]
+            waited.append(first_read.wait(timeout=5.0))
+            yield from filepaths[1:3]
+
+        read_bytes.read_file = lambda *args: first_read.set() or read_file(*args)
+        try:
+            assert len(list(Pipe(slow_source()).read_bytes())) == 3
+            assert waited == [True]
+        finally:
+            read_bytes.read_file = read_file
+
+        errors = []
+        pipe = Pipe([filepaths[0], "missing"]).read_bytes(handler=errors.append)
+        assert list(pipe) == [b"\x00"] and len(errors) == 1
+
+
+def test_tee():
+    import os
+    import tempfile
+
+    from pipd import Batch, Limit, Map, Side
+
+    with tempfile.TemporaryDirectory() as d:
+        filepath = os.path.join(d, "out.txt")
+        total = []
+        batches = []
+        pipe = Pipe(x for x in range(10)).tee(
+            Pipe.write_lines(filepath),
+            Map(lambda x: x * 2) | Side(total.append),
+            Batch(4) | Side(batches.append),
+            Limit(2),
+            buffer=2,
+        )
+        assert list(pipe) == list(range(10))
+        with open(filepath) as f:
+            assert f.read() == "".join(f"{x}\n" for x in range(10))
+        assert total == [x * 2 for x in range(10)]
+        assert batches == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+
+        # Branches flush when the pipeline is stopped early
+        pipe = Pipe(range(10)).tee(Pipe.write_lines(filepath)).limit(3)
+        assert list(pipe) == [0, 1, 2]
+        with open(filepath) as f:
+            assert f.read() == "0\n1\n2\n"
+
+
 def test_mix_pipe():
     from pipd import Mix
 
@@ -225,3 +735,44 @@ def test_mix_pipe():
     assert next(it) == "e"
     assert next(it) == 1
     assert next(it) == "a"
+
+
+def test_records():
+    import os
+    import pickle
+    import tempfile
+
+    from pipd import Records
+
+    with tempfile.TemporaryDirectory() as d:
+        filepath = os.path.join(d, "records.bin")
+        items = [{"id": i, "data": b"x" * i} for i in range(10)]
+        assert list(Pipe(items).write_records(filepath)) == items
+
+        with Records(filepath) as records:
+            assert len(records) == 10
+            assert records[3] == items[3]
+            assert records[-1] == items[-1]
+            assert pickle.loads(pickle.dumps(records))[5] == items[5]
+            assert records.index(items[2]) == 2
+
+        pipe = Pipe([filepath]).read_records()
+        assert list(pipe) == items
+        pipe = Pipe([filepath, filepath]).read_records(shuffle=True, seed=0)
+        result = list(pipe)
+        assert result != items + items
+        assert sorted(result, key=lambda x: x["id"]) == sorted(
+            items + items, key=lambda x: x["id"]
+        )
+        shards = [
+            list(Pipe([filepath]).read_records(shard=i, num_shards=3)) for i in range(3)
+        ]
+        assert shards[0] + shards[1] + shards[2] == items
+
+        # Raw bytes, and index rebuilt by scanning if the sidecar is missing
+        list(Pipe([b"a", b"bc", b""]).write_records(filepath, format="raw"))
+        os.remove(filepath + ".idx")
+        pipe = Pipe([filepath]).read_records(format="raw")
+        assert list(pipe) == [b"a", b"bc", b""]
+        with pytest.raises(TypeError):
+            list(Pipe([3]).write_records(filepath, format="raw"))